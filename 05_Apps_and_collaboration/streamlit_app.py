@@ -3,7 +3,6 @@
 # Import necessary libraries
 import streamlit as st
 import pandas as pd
-import altair as alt
 from snowflake.snowpark.context import get_active_session
 
 # --- App Setup and Data Loading ---
@@ -16,57 +15,80 @@ st.title("📊 Menu Item Sales & Weather in Japan")
 st.write("2022年2月 東京の売上データと天気データを可視化します")
 st.write('---')
 
-# Load sales data (original table)
+# Load menu item names (original table)
 @st.cache_data()
-def load_sales_data():
+def load_menu_items():
     """
-    Load sales data from the original Japan menu item sales table for February 2022.
+    Return the sorted distinct menu item names from the Japan menu item sales table for February 2022.
     """
-    df = session.table("tb_101.analytics.japan_menu_item_sales_feb_2022").to_pandas()
+    query = """
+        SELECT DISTINCT MENU_ITEM_NAME
+        FROM tb_101.analytics.japan_menu_item_sales_feb_2022
+        ORDER BY MENU_ITEM_NAME
+    """
+    return [row['MENU_ITEM_NAME'] for row in session.sql(query).collect()]
+
+# Load daily sales for one menu item (original table); cached through aggregate_daily()
+def load_daily_sales(menu_item):
+    """
+    Return daily sales totals for the given menu item in February 2022.
+    The filter and daily aggregation run in Snowflake, so at most one row per day is returned.
+    """
+    query = """
+        SELECT
+            DATE,
+            SUM(ORDER_TOTAL) AS ORDER_TOTAL
+        FROM tb_101.analytics.japan_menu_item_sales_feb_2022
+        WHERE MENU_ITEM_NAME = ?
+        GROUP BY DATE
+        ORDER BY DATE
+    """
+    df = session.sql(query, params=[menu_item]).to_pandas()
+    # Convert DATE only if Snowpark did not already return datetime64
+    if not pd.api.types.is_datetime64_any_dtype(df['DATE']):
+        df['DATE'] = pd.to_datetime(df['DATE'])
     return df
 
 # Load weather data (filtered to Tokyo, Feb 2022)
 @st.cache_data()
 def load_weather_data():
     """
-    Load weather data from daily_sales_by_weather_v, filtered to Tokyo and February 2022.
+    Load daily weather data from daily_sales_by_weather_v, filtered to Tokyo and February 2022.
+    The view has one row per date and menu item, so the daily average is computed in Snowflake
+    and only one row per day is returned.
     Reference: https://app.snowflake.com/marketplace/listing/GZSOZ1LLEL/weather-source-llc-weather-source-llc-frostbyte
     """
     query = """
         SELECT 
             DATE,
-            AVG_TEMP_FAHRENHEIT,
-            AVG_PRECIPITATION_INCHES,
-            AVG_SNOWDEPTH_INCHES,
-            MAX_WIND_SPEED_MPH
+            AVG(AVG_TEMP_FAHRENHEIT) AS AVG_TEMP_FAHRENHEIT,
+            AVG(AVG_PRECIPITATION_INCHES) AS AVG_PRECIPITATION_INCHES,
+            AVG(AVG_SNOWDEPTH_INCHES) AS AVG_SNOWDEPTH_INCHES,
+            AVG(MAX_WIND_SPEED_MPH) AS MAX_WIND_SPEED_MPH
         FROM tb_101.analytics.daily_sales_by_weather_v
-        WHERE CITY_NAME = 'Tokyo'
-          AND YEAR(DATE) = 2022
-          AND MONTH(DATE) = 2
+        WHERE CITY_NAME = ?
+          AND DATE BETWEEN ? AND ?
+        GROUP BY DATE
+        ORDER BY DATE
     """
-    df = session.sql(query).to_pandas()
-    df['DATE'] = pd.to_datetime(df['DATE'])
-    # Get daily average weather (aggregate by date)
-    weather_daily = df.groupby('DATE').agg({
-        'AVG_TEMP_FAHRENHEIT': 'mean',
-        'AVG_PRECIPITATION_INCHES': 'mean',
-        'AVG_SNOWDEPTH_INCHES': 'mean',
-        'MAX_WIND_SPEED_MPH': 'mean'
-    }).reset_index()
-    return weather_daily
+    df = session.sql(query, params=['Tokyo', '2022-02-01', '2022-02-28']).to_pandas()
+    # Convert DATE only if Snowpark did not already return datetime64
+    if not pd.api.types.is_datetime64_any_dtype(df['DATE']):
+        df['DATE'] = pd.to_datetime(df['DATE'])
+    # Index by DATE so sales can be joined on it (already sorted by ORDER BY DATE)
+    return df.set_index('DATE')
 
 # Load data with spinner
 with st.spinner('データを読み込んでいます...'):
-    japan_sales = load_sales_data()
+    menu_item_names = load_menu_items()
     weather_data = load_weather_data()
 
-st.success(f"✅ 売上データ: {len(japan_sales):,} 件 / 天気データ: {len(weather_data):,} 日分")
+st.success(f"✅ メニューアイテム: {len(menu_item_names):,} 種類 / 天気データ: {len(weather_data):,} 日分")
 
 # --- Sidebar Filters ---
 st.sidebar.header("🔍 フィルター設定")
 
 # Menu item selection
-menu_item_names = sorted(japan_sales['MENU_ITEM_NAME'].unique().tolist())
 selected_menu_item = st.sidebar.selectbox("🍽️ メニューアイテムを選択", options=menu_item_names)
 
 # Weather metric selection
@@ -84,26 +106,36 @@ st.sidebar.info(f"🍽️ {selected_menu_item}\n\n{selected_weather_label}")
 
 # --- Data Preparation ---
 
-# Filter sales data by selected menu item
-menu_item_sales = japan_sales[japan_sales['MENU_ITEM_NAME'] == selected_menu_item]
+# Join the daily sales for a menu item (aggregated in Snowflake) with the weather data.
+# The result holds all four weather metrics and is cached per menu item, so switching
+# the weather metric only re-points the chart at another column.
+@st.cache_data(max_entries=64)
+def aggregate_daily(menu_item):
+    """
+    Return daily sales totals for the given menu item joined with the daily averages of
+    all four weather metrics.
+    """
+    # Daily totals for the menu item, aggregated in Snowflake
+    daily_sales = load_daily_sales(menu_item).set_index('DATE')
+
+    # Join sales and weather data on their sorted DATE indexes
+    return daily_sales.join(load_weather_data(), how='inner').reset_index()
 
-# Group by date for daily totals
-daily_sales = menu_item_sales.groupby('DATE')['ORDER_TOTAL'].sum().reset_index()
-daily_sales['DATE'] = pd.to_datetime(daily_sales['DATE'])
+merged_data = aggregate_daily(selected_menu_item)
 
-# Merge sales and weather data
-merged_data = pd.merge(daily_sales, weather_data, on='DATE', how='inner')
+# Three-column copy with only the columns used below (metrics, chart and table)
+daily_data = merged_data[['DATE', 'ORDER_TOTAL', selected_weather_metric]]
 
 # --- Display Metrics ---
 col1, col2, col3 = st.columns(3)
 with col1:
-    total_sales = merged_data['ORDER_TOTAL'].sum()
+    total_sales = daily_data['ORDER_TOTAL'].sum()
     st.metric("💰 総売上", f"${total_sales:,.0f}")
 with col2:
-    avg_weather = merged_data[selected_weather_metric].mean()
+    avg_weather = daily_data[selected_weather_metric].mean()
     st.metric(f"平均 {selected_weather_label}", f"{avg_weather:.1f}")
 with col3:
-    data_points = len(merged_data)
+    data_points = len(daily_data)
     st.metric("📊 データポイント", f"{data_points} 日")
 
 st.write('---')
@@ -111,70 +143,49 @@ st.write('---')
 # --- Dual-Axis Chart ---
 st.subheader(f"📈 {selected_menu_item} の売上と{selected_weather_label}の推移")
 
-# Base chart
-base = alt.Chart(merged_data).encode(
-    x=alt.X('DATE:T', 
-            axis=alt.Axis(title='日付', format='%b %d'),
-            title='日付')
-)
-
-# Sales line (Left Y-axis) - Blue
-sales_line = base.mark_line(
-    color='#1f77b4',
-    strokeWidth=2
-).encode(
-    y=alt.Y('ORDER_TOTAL:Q',
-            axis=alt.Axis(title='売上 ($)', titleColor='#1f77b4'))
-)
-
-sales_points = base.mark_circle(
-    color='#1f77b4',
-    size=60
-).encode(
-    y=alt.Y('ORDER_TOTAL:Q'),
-    tooltip=[
-        alt.Tooltip('DATE:T', title='日付', format='%Y-%m-%d'),
-        alt.Tooltip('ORDER_TOTAL:Q', title='売上', format='$,.0f'),
-        alt.Tooltip(f'{selected_weather_metric}:Q', title=selected_weather_label, format='.1f')
-    ]
-)
-
-# Weather line (Right Y-axis) - Orange
-weather_line = base.mark_line(
-    color='#ff7f0e',
-    strokeWidth=2,
-    strokeDash=[5, 5]
-).encode(
-    y=alt.Y(f'{selected_weather_metric}:Q',
-            axis=alt.Axis(title=selected_weather_label, titleColor='#ff7f0e'))
-)
-
-weather_points = base.mark_circle(
-    color='#ff7f0e',
-    size=60
-).encode(
-    y=alt.Y(f'{selected_weather_metric}:Q'),
-    tooltip=[
-        alt.Tooltip('DATE:T', title='日付', format='%Y-%m-%d'),
-        alt.Tooltip('ORDER_TOTAL:Q', title='売上', format='$,.0f'),
-        alt.Tooltip(f'{selected_weather_metric}:Q', title=selected_weather_label, format='.1f')
-    ]
-)
-
-# Combine with independent Y-axes (dual-axis effect)
-combined_chart = alt.layer(
-    sales_line + sales_points,
-    weather_line + weather_points
-).resolve_scale(
-    y='independent'
-).properties(
-    width='container',
-    height=450,
-    title=f'Tokyo - {selected_menu_item} (February 2022)'
-)
-
-# Display the chart
-st.altair_chart(combined_chart, use_container_width=True)
+# Vega-Lite spec for the dual-axis chart
+spec = {
+    '$schema': 'https://vega.github.io/schema/vega-lite/v5.json',
+    'title': f'Tokyo - {selected_menu_item} (February 2022)',
+    'encoding': {
+        'x': {'field': 'DATE', 'type': 'temporal', 'title': '日付',
+              'axis': {'title': '日付', 'format': '%b %d'}}
+    },
+    'layer': [
+        # Sales line (Left Y-axis) - Blue
+        {'mark': {'type': 'line', 'color': '#1f77b4', 'strokeWidth': 2,
+                  'point': {'color': '#1f77b4', 'size': 60}},
+         'encoding': {'y': {'field': 'ORDER_TOTAL', 'type': 'quantitative',
+                            'axis': {'title': '売上 ($)', 'titleColor': '#1f77b4'}}}},
+        # Weather line (Right Y-axis) - Orange
+        {'mark': {'type': 'line', 'color': '#ff7f0e', 'strokeWidth': 2, 'strokeDash': [5, 5],
+                  'point': {'color': '#ff7f0e', 'size': 60}},
+         'encoding': {'y': {'field': selected_weather_metric, 'type': 'quantitative',
+                            'axis': {'title': selected_weather_label, 'titleColor': '#ff7f0e'}}}},
+        # Hover rule: one layer picks the nearest date and shows the tooltip for both series
+        {'mark': {'type': 'rule', 'color': 'gray'},
+         'params': [{'name': 'hover',
+                     'select': {'type': 'point', 'on': 'mouseover', 'clear': 'mouseout',
+                                'nearest': True, 'encodings': ['x']}}],
+         'encoding': {
+             'opacity': {'condition': {'param': 'hover', 'empty': False, 'value': 0.5}, 'value': 0},
+             'tooltip': [
+                 {'field': 'DATE', 'type': 'temporal', 'title': '日付', 'format': '%Y-%m-%d'},
+                 {'field': 'ORDER_TOTAL', 'type': 'quantitative', 'title': '売上', 'format': '$,.0f'},
+                 {'field': selected_weather_metric, 'type': 'quantitative',
+                  'title': selected_weather_label, 'format': '.1f'}
+             ]
+         }}
+    ],
+    # Independent Y-axes (dual-axis effect)
+    'resolve': {'scale': {'y': 'independent'}},
+    'width': 'container',
+    'height': 450
+}
+
+# Display the chart. The spec has no inline data; Streamlit sends the DataFrame to the
+# browser as Arrow, so only the three-column copy is passed.
+st.vega_lite_chart(daily_data, spec, use_container_width=True)
 
 # Legend
 st.markdown("""
@@ -187,7 +198,14 @@ st.write('---')
 
 # --- Data Table ---
 with st.expander("📋 データテーブルを表示"):
-    display_data = merged_data[['DATE', 'ORDER_TOTAL', selected_weather_metric]].copy()
-    display_data['DATE'] = display_data['DATE'].dt.strftime('%Y-%m-%d')
-    display_data.columns = ['日付', '売上 ($)', selected_weather_label]
-    st.dataframe(display_data, use_container_width=True)
+    # Labels and formats are applied by the front end, so no string copy of the data is built
+    st.dataframe(
+        daily_data,
+        column_config={
+            'DATE': st.column_config.DatetimeColumn('日付', format='YYYY-MM-DD'),
+            'ORDER_TOTAL': st.column_config.NumberColumn('売上 ($)', format='$%.2f'),
+            selected_weather_metric: st.column_config.NumberColumn(selected_weather_label, format='%.1f')
+        },
+        use_container_width=True,
+        hide_index=True
+    )